@@ -1,17 +1,14 @@
 """
 Class to represent a layer of a configuration state to visualize images in neuroglancer
 """
-import inspect
+import functools
 import json
-import multiprocessing
 import os
 import struct
 import time
-from multiprocessing.managers import BaseManager, NamespaceProxy
 from pathlib import Path
 from typing import Dict, List, Optional, Union, get_args
 
-import neuroglancer
 import numpy as np
 
 from .utils import shader_utils, utils
@@ -19,59 +16,39 @@ from .utils import shader_utils, utils
 # IO types
 PathLike = Union[str, Path]
 SourceLike = Union[PathLike, List[Dict]]
+_PATHLIKE_TYPES = get_args(PathLike)
 
 
-class ObjProxy(NamespaceProxy):
-    """Returns a proxy instance for any user defined data-type. The proxy instance will have the namespace and
-    functions of the data-type (except private/protected callables/attributes). Furthermore, the proxy will be
-    pickable and can its state can be shared among different processes."""
+# Cells converted and written per chunk to bound the memory
+_CELLS_CHUNK_SIZE = 1 << 20
 
-    @classmethod
-    def populate_obj_attributes(cls, real_cls):
-        """
-        Populates attributes of the proxy object
-        """
-        DISALLOWED = set(dir(cls))
-        ALLOWED = [
-            "__sizeof__",
-            "__eq__",
-            "__ne__",
-            "__le__",
-            "__repr__",
-            "__dict__",
-            "__lt__",
-            "__gt__",
-        ]
-        DISALLOWED.add("__class__")
-        new_dict = {}
-        for attr, value in inspect.getmembers(real_cls, callable):
-            if attr not in DISALLOWED or attr in ALLOWED:
-                new_dict[attr] = cls._proxy_wrap(attr)
-        return new_dict
 
-    @staticmethod
-    def _proxy_wrap(attr):
-        """
-        This method creates function that calls the proxified object's method.
-        """
-
-        def f(self, *args, **kwargs):
-            """
-            Function that calls the proxified object's method.
-            """
-            return self._callmethod(attr, args, kwargs)
-
-        return f
+def helper_cells_to_array(cells: Union[List[dict], np.ndarray]) -> np.ndarray:
+    """
+    Helper function to get the cell locations in z, y, x order
 
+    Parameters
+    ------------------------
+    cells: Union[List[dict], np.ndarray]
+        List of cell dicts, or array with shape (N, 3)
+        and the (x, y, z) location of the cells.
 
-def buf_builder(x, y, z, buf_):
-    """builds the buffer"""
-    pt_buf = struct.pack("<3f", x, y, z)
-    buf_.extend(pt_buf)
+    Returns
+    ------------------------
+    np.ndarray
+        Array with shape (N, 3) and the (z, y, x)
+        location of the cells.
+    """
 
+    if isinstance(cells, np.ndarray):
+        return cells.reshape(-1, 3)[:, ::-1]
 
-attributes = ObjProxy.populate_obj_attributes(bytearray)
-bytearrayProxy = type("bytearrayProxy", (ObjProxy,), attributes)
+    # Single pass over the dicts
+    return np.fromiter(
+        (int(cell[axis]) for cell in cells for axis in ("z", "y", "x")),
+        dtype=np.int32,
+        count=3 * len(cells),
+    ).reshape(-1, 3)
 
 
 def generate_precomputed_cells(cells, path, res):
@@ -81,38 +58,52 @@ def generate_precomputed_cells(cells, path, res):
     Parameters
     -----------------
 
-    cells: dict
-        output of the xmltodict function for importing cell locations
+    cells: Union[List[dict], np.ndarray]
+        cell locations from get_points_from_xml, or an array
+        with shape (N, 3) and the (x, y, z) location of the
+        cells from get_points_from_xml_array
     path: str
         path to where you want to save the precomputed files
     res: neuroglancer.CoordinateSpace()
         data on the space that the data will be viewed
-    buf: bytearrayProxy object
-        if you want to use multiprocessing set to bytearrayProxy object else
-        leave as None
 
     """
 
-    BaseManager.register(
-        "bytearray",
-        bytearray,
-        bytearrayProxy,
-        exposed=tuple(dir(bytearrayProxy)),
-    )
-    manager = BaseManager()
-    manager.start()
+    total_count = len(cells)
+
+    output_path = os.path.join(path, "spatial0")
+    utils.create_folder(output_path)
 
-    buf = manager.bytearray()
+    chunk_l_bounds = []
+    chunk_u_bounds = []
 
-    cell_list = []
-    for cell in cells:
-        cell_list.append([int(cell["z"]), int(cell["y"]), int(cell["x"])])
+    with open(os.path.join(output_path, "0_0_0"), "wb") as outfile:
+        start_t = time.time()
 
-    l_bounds = np.min(cell_list, axis=0)
-    u_bounds = np.max(cell_list, axis=0)
+        # Count, points as little endian float32 and increasing ids
+        # streamed to the file one chunk of cells at a time
+        outfile.write(struct.pack("<Q", total_count))
 
-    output_path = os.path.join(path, "spatial0")
-    utils.create_folder(output_path)
+        for chunk_start in range(0, total_count, _CELLS_CHUNK_SIZE):
+            cell_array = helper_cells_to_array(
+                cells[chunk_start : chunk_start + _CELLS_CHUNK_SIZE]
+            )
+            chunk_l_bounds.append(cell_array.min(axis=0))
+            chunk_u_bounds.append(cell_array.max(axis=0))
+            cell_array.astype("<f4").tofile(outfile)
+
+        for chunk_start in range(0, total_count, _CELLS_CHUNK_SIZE):
+            chunk_stop = min(chunk_start + _CELLS_CHUNK_SIZE, total_count)
+            np.arange(chunk_start, chunk_stop, dtype="<u8").tofile(outfile)
+
+        print(
+            "Building file took {0} minutes".format(
+                (time.time() - start_t) / 60
+            )
+        )
+
+    l_bounds = np.min(chunk_l_bounds, axis=0)
+    u_bounds = np.max(chunk_u_bounds, axis=0)
 
     metadata = {
         "@type": "neuroglancer_annotations_v1",
@@ -130,7 +121,7 @@ def generate_precomputed_cells(cells, path, res):
                 "key": "spatial0",
                 "grid_shape": [1] * res.rank,
                 "chunk_size": [max(1, float(x)) for x in u_bounds - l_bounds],
-                "limit": len(cell_list),
+                "limit": total_count,
             },
         ],
     }
@@ -138,46 +129,30 @@ def generate_precomputed_cells(cells, path, res):
     with open(os.path.join(path, "info"), "w") as f:
         f.write(json.dumps(metadata))
 
-    with open(os.path.join(output_path, "0_0_0"), "wb") as outfile:
-        start_t = time.time()
-
-        total_count = len(cell_list)  # coordinates is a list of tuples (x,y,z)
-
-        print("Running multiprocessing")
 
-        if not isinstance(buf, type(None)):
-            buf.extend(struct.pack("<Q", total_count))
-
-            with multiprocessing.Pool(processes=os.cpu_count()) as p:
-                p.starmap(
-                    buf_builder, [(x, y, z, buf) for (x, y, z) in cell_list]
-                )
-
-            # write the ids at the end of the buffer as increasing integers
-            id_buf = struct.pack(
-                "<%sQ" % len(cell_list), *range(len(cell_list))
-            )
-            buf.extend(id_buf)
-        else:
-            buf = struct.pack("<Q", total_count)
+@functools.lru_cache(maxsize=None)
+def helper_identity_matrix(n_rows: int, n_cols: int) -> np.ndarray:
+    """
+    Helper function to get a cached read-only identity matrix
+    used as template for the translation matrices
 
-            for x, y, z in cell_list:
-                pt_buf = struct.pack("<3f", x, y, z)
-                buf += pt_buf
+    Parameters
+    ------------------------
+    n_rows: int
+        number of rows of the identity matrix.
+    n_cols: int
+        number of columns of the identity matrix.
 
-            # write the ids at the end of the buffer as increasing integers
-            id_buf = struct.pack(
-                "<%sQ" % len(cell_list), *range(len(cell_list))
-            )
-            buf += id_buf
+    Returns
+    ------------------------
+    np.ndarray
+        Read-only identity matrix with shape (n_rows, n_cols)
+    """
 
-        print(
-            "Building file took {0} minutes".format(
-                (time.time() - start_t) / 60
-            )
-        )
+    identity_matrix = np.eye(n_rows, n_cols, dtype=np.float64)
+    identity_matrix.setflags(write=False)
 
-        outfile.write(bytes(buf))
+    return identity_matrix
 
 
 def helper_create_ng_translation_matrix(
@@ -215,9 +190,6 @@ def helper_create_ng_translation_matrix(
         List with the translation matrix
     """
 
-    translation_matrix = np.zeros((n_rows, n_cols), np.float16)
-    np.fill_diagonal(translation_matrix, 1)
-
     deltas = [delta_x, delta_y, delta_z]
     start_point = n_rows - 1
 
@@ -226,12 +198,70 @@ def helper_create_ng_translation_matrix(
             "N size of transformation matrix is not enough for deltas"
         )
 
+    # Fresh python lists from the cached identity matrix
+    translation_matrix = helper_identity_matrix(n_rows, n_cols).tolist()
+
     # Setting translations for axis
     for delta in deltas:
-        translation_matrix[start_point][-1] = delta
+        translation_matrix[start_point][-1] = float(delta)
         start_point -= 1
 
-    return translation_matrix.tolist()
+    return translation_matrix
+
+
+def helper_create_ng_translation_matrices(
+    deltas: List[List[float]],
+    n_cols: Optional[int] = 6,
+    n_rows: Optional[int] = 5,
+) -> List:
+    """
+    Helper function to create several translation matrices at once
+    based on deltas over each axis
+
+    Parameters
+    ------------------------
+    deltas: List[List[float]]
+        List with the [delta_x, delta_y, delta_z] translations
+        of each matrix.
+    n_cols: Optional[int]
+        number of columns to create the translation matrices.
+    n_rows: Optional[int]
+        number of rows to create the translation matrices.
+
+    Raises
+    ------------------------
+    ValueError:
+        Raises if the N size of the transformation matrices is not
+        enough for the deltas.
+
+    Returns
+    ------------------------
+    List
+        List with the translation matrices
+    """
+
+    deltas = np.asarray(deltas, dtype=np.float64).reshape(-1, 3)
+    n_deltas = deltas.shape[1]
+
+    if n_rows - 1 < n_deltas:
+        raise ValueError(
+            "N size of transformation matrix is not enough for deltas"
+        )
+
+    translation_matrices = np.repeat(
+        helper_identity_matrix(n_rows, n_cols)[np.newaxis],
+        deltas.shape[0],
+        axis=0,
+    )
+
+    # Setting translations for axis through a strided view of the
+    # last column, x goes in the last row
+    start_point = n_rows - 1
+    translation_matrices[:, start_point : start_point - n_deltas : -1, -1] = (
+        deltas
+    )
+
+    return translation_matrices.tolist()
 
 
 def helper_reverse_dictionary(dictionary: dict) -> dict:
@@ -249,14 +279,9 @@ def helper_reverse_dictionary(dictionary: dict) -> dict:
         Reversed dictionary
     """
 
-    keys = list(dictionary.keys())
-    values = list(dictionary.values())
-    new_dict = {}
-
-    for idx in range(len(keys) - 1, -1, -1):
-        new_dict[keys[idx]] = values[idx]
-
-    return new_dict
+    # Reversed items view is a single pass over the dict entries,
+    # faster than rebuilding it with a comprehension over reversed keys
+    return dict(reversed(dictionary.items()))
 
 
 class SegmentationLayer:
@@ -469,7 +494,7 @@ class SegmentationLayer:
         new_layer_state: dict
             Dictionary with the new configuration of the layer state.
         """
-        self.__layer_state = dict(new_layer_state)
+        self.__layer_state = new_layer_state.copy()
 
 
 class AnnotationLayer:
@@ -481,7 +506,7 @@ class AnnotationLayer:
     def __init__(
         self,
         annotation_source: Union[str, dict],
-        annotation_locations: List[dict],
+        annotation_locations: Union[List[dict], np.ndarray],
         output_dimensions: dict,
         mount_service: str,
         bucket_path: str,
@@ -497,9 +522,11 @@ class AnnotationLayer:
         annotation_source: Union[str, dict]
             Location of the annotation layer information
 
-        annotation_locations: List[dict]
+        annotation_locations: Union[List[dict], np.ndarray]
             List with the location of the points. The dictionary
-            must have this order: {"x": valx, "y": valy, "z": valz}
+            must have this order: {"x": valx, "y": valy, "z": valz}.
+            Precomputed sources also accept the (N, 3) array with
+            the (x, y, z) locations from get_points_from_xml_array.
 
         output_dimensions: dict
             Dictionary with the output dimensions of the layer.
@@ -614,6 +641,9 @@ class AnnotationLayer:
 
             write_path = Path(source.replace("precomputed://", ""))
 
+            # neuroglancer is slow to import, only needed here
+            import neuroglancer
+
             coord_space = neuroglancer.CoordinateSpace(
                 names=names, units=units, scales=scales
             )
@@ -876,7 +906,7 @@ class AnnotationLayer:
         new_layer_state: dict
             Dictionary with the new configuration of the layer state.
         """
-        self.__layer_state = dict(new_layer_state)
+        self.__layer_state = new_layer_state.copy()
 
 
 class ImageLayer:
@@ -885,6 +915,29 @@ class ImageLayer:
     configuration json
     """
 
+    __slots__ = (
+        "__layer_state",
+        "__mount_prefix",
+        "__source_stem",
+        "image_config",
+        "mount_service",
+        "bucket_path",
+        "layer_type",
+        "output_dimensions",
+        "image_source",
+    )
+
+    # Image config parameters saved as strings in the layer state
+    _STRING_PARAMS = frozenset(["type", "name", "blend"])
+
+    # Image config parameters and the property that sets them
+    _PROPERTY_PARAMS = {
+        "visible": "visible",
+        "channel": "image_channel",
+        "shaderControls": "shader_control",
+        "opacity": "opacity",
+    }
+
     def __init__(
         self,
         image_config: dict,
@@ -910,20 +963,31 @@ class ImageLayer:
         """
 
         self.__layer_state = {}
-        self.image_config = image_config
+        # Copy to avoid modifying the caller's configuration
+        self.image_config = image_config.copy()
         self.mount_service = mount_service
+        self.__mount_prefix = f"{mount_service}://"
         self.bucket_path = bucket_path
         self.layer_type = layer_type
 
         # Optional parameter that must be used when we have multiple images per layer
         # Dictionary needs to be reversed for correct visualization
-        self.output_dimensions = helper_reverse_dictionary(output_dimensions)
+        self.output_dimensions = None
+        if output_dimensions is not None:
+            self.output_dimensions = helper_reverse_dictionary(
+                output_dimensions
+            )
 
-        # Fix image source
+        # Fix image source, it is only stored once in the layer state
         self.image_source = self.__fix_image_source(image_config["source"])
-        image_config["source"] = self.image_source
+        self.image_config["source"] = self.image_source
+        self.__layer_state["source"] = self.image_source
+
+        # Stem of the (first) image source, parsed when naming the layer
+        self.__source_stem = None
 
-        self.update_state(image_config)
+        # The whole config is needed to set the default values
+        self.update_state(self.image_config)
 
     def __set_s3_path(self, orig_source_path: PathLike) -> str:
         """
@@ -946,32 +1010,28 @@ class ImageLayer:
             String with the source path pointing to the mount service in the cloud
         """
 
-        s3_path = None
-        if not orig_source_path.startswith(f"{self.mount_service}://"):
+        s3_path = str(orig_source_path)
+
+        # Paths that are not already pointing to the mount service
+        if not s3_path.startswith(self.__mount_prefix):
             # Work with code ocean
-            if "/scratch/" in orig_source_path:
-                orig_source_path = orig_source_path.replace("/scratch/", "")
+            if "/scratch/" in s3_path:
+                s3_path = s3_path.replace("/scratch/", "")
 
-            elif "/results/" in orig_source_path:
-                orig_source_path = orig_source_path.replace("/results/", "")
+            elif "/results/" in s3_path:
+                s3_path = s3_path.replace("/results/", "")
 
-            orig_source_path = Path(orig_source_path)
+            # Path normalizes local paths, e.g. trailing slashes or ./
             s3_path = (
-                f"{self.mount_service}://{self.bucket_path}/{orig_source_path}"
+                f"{self.__mount_prefix}{self.bucket_path}/{Path(s3_path)}"
             )
 
-        else:
-            s3_path = orig_source_path
-
-        if s3_path.endswith(".zarr"):
-            s3_path = "zarr://" + s3_path
-
-        else:
+        if not s3_path.endswith((".zarr", ".zarr/")):
             raise NotImplementedError(
                 "This format has not been implemented yet for visualization"
             )
 
-        return s3_path
+        return f"zarr://{s3_path}"
 
     def __set_sources_paths(self, sources_paths: List) -> List:
         """
@@ -993,37 +1053,54 @@ class ImageLayer:
         """
         new_source_path = []
 
+        # Building all the translation matrices in a single batch
+        deltas = [
+            [
+                source["transform_matrix"]["delta_x"],
+                source["transform_matrix"]["delta_y"],
+                source["transform_matrix"]["delta_z"],
+            ]
+            for source in sources_paths
+            if isinstance(source.get("transform_matrix"), dict)
+        ]
+        translation_matrices = iter(
+            helper_create_ng_translation_matrices(deltas)
+        )
+
+        # Same dictionary object is shared by every source transform,
+        # neuroglancer does not accept null output dimensions
+        output_dimensions = {}
+        if self.output_dimensions is not None:
+            output_dimensions = {"outputDimensions": self.output_dimensions}
+
+        # Local references used for every source
+        set_s3_path = self.__set_s3_path
+        append_source = new_source_path.append
+        next_translation_matrix = translation_matrices.__next__
+
         for source in sources_paths:
             new_dict = {}
 
-            for key in source.keys():
-                if key == "transform_matrix" and isinstance(
-                    source["transform_matrix"], dict
-                ):
+            for key, value in source.items():
+                if key == "transform_matrix" and isinstance(value, dict):
                     new_dict["transform"] = {
-                        "matrix": helper_create_ng_translation_matrix(
-                            delta_x=source["transform_matrix"]["delta_x"],
-                            delta_y=source["transform_matrix"]["delta_y"],
-                            delta_z=source["transform_matrix"]["delta_z"],
-                        ),
-                        "outputDimensions": self.output_dimensions,
+                        "matrix": next_translation_matrix(),
+                        **output_dimensions,
                     }
 
-                elif key == "transform_matrix" and isinstance(
-                    source["transform_matrix"], list
-                ):
+                elif key == "transform_matrix" and isinstance(value, list):
                     new_dict["transform"] = {
-                        "matrix": source["transform_matrix"],
-                        "outputDimensions": self.output_dimensions,
+                        "matrix": value,
+                        **output_dimensions,
                     }
 
                 elif key == "url":
-                    new_dict["url"] = self.__set_s3_path(source["url"])
+                    new_dict["url"] = set_s3_path(value)
 
                 else:
-                    new_dict[key] = source[key]
+                    new_dict[key] = value
 
-            new_source_path.append(new_dict)
+            append_source(new_dict)
 
         return new_source_path
 
@@ -1036,22 +1113,47 @@ class ImageLayer:
         source_path: SourceLike
             Path or list of paths where the images are located with their transformation matrix.
 
+        Raises
+        ------------------------
+        TypeError:
+            Raises if the source is not a path or a list of sources.
+
         Returns
         ------------------------
         SourceLike
             Fixed path(s) for neuroglancer json configuration.
         """
-        new_source_path = None
 
         if isinstance(source_path, list):
             # multiple sources in single image
-            new_source_path = self.__set_sources_paths(source_path)
+            return self.__set_sources_paths(source_path)
 
-        elif isinstance(source_path, get_args(PathLike)):
-            # Single source image
-            new_source_path = self.__set_s3_path(source_path)
+        if not isinstance(source_path, _PATHLIKE_TYPES):
+            raise TypeError(
+                f"Image source must be a path or a list. Received: {source_path}"
+            )
 
-        return new_source_path
+        # Single source image
+        return self.__set_s3_path(source_path)
+
+    def __get_source_stem(self) -> str:
+        """
+        Gets the stem of the image source, or of the first source
+        url with multiple sources. It is only parsed once.
+
+        Returns
+        ------------------------
+        str
+            Stem used to name the layer.
+        """
+        if self.__source_stem is None:
+            if isinstance(self.image_source, _PATHLIKE_TYPES):
+                self.__source_stem = Path(self.image_source).stem
+
+            else:
+                self.__source_stem = Path(self.image_source[0]["url"]).stem
+
+        return self.__source_stem
 
     # flake8: noqa: C901
     def set_default_values(
@@ -1074,7 +1176,7 @@ class ImageLayer:
             self.image_channel = 0
             self.shader_control = {"normalized": {"range": [0, 200]}}
             self.visible = True
-            self.__layer_state["name"] = str(Path(self.image_source).stem)
+            self.__layer_state["name"] = self.__get_source_stem()
             self.__layer_state["type"] = str(self.layer_type)
 
         elif len(image_config):
@@ -1096,15 +1198,9 @@ class ImageLayer:
                 except KeyError:
                     channel = ""
 
-                if isinstance(self.image_source, get_args(PathLike)):
-                    self.__layer_state[
-                        "name"
-                    ] = f"{Path(self.image_source).stem}_{channel}"
-
-                else:
-                    self.__layer_state[
-                        "name"
-                    ] = f"{Path(self.image_source[0]['url']).stem}_{channel}"
+                self.__layer_state["name"] = (
+                    f"{self.__get_source_stem()}_{channel}"
+                )
 
             if "type" not in image_config:
                 self.__layer_state["type"] = str(self.layer_type)
@@ -1134,34 +1230,22 @@ class ImageLayer:
                     }
                 }
             }
+            The source is already fixed and stored by the constructor,
+            so it is skipped here.
         """
 
         for param, value in image_config.items():
-            if param in ["type", "name", "blend"]:
+            if param in self._STRING_PARAMS:
                 self.__layer_state[param] = str(value)
+                continue
 
-            if param in ["visible"]:
-                self.visible = value
-
-            if param == "shader":
-                self.shader = self.__create_shader(value)
-
-            if param == "channel":
-                self.image_channel = value
-
-            if param == "shaderControls":
-                self.shader_control = value
+            property_name = self._PROPERTY_PARAMS.get(param)
 
-            if param == "opacity":
-                self.opacity = value
+            if property_name is not None:
+                setattr(self, property_name, value)
 
-            if param == "source":
-                if isinstance(value, get_args(PathLike)):
-                    self.__layer_state[param] = str(value)
-
-                elif isinstance(value, list):
-                    # Setting list of dictionaries with image configuration
-                    self.__layer_state[param] = value
+            elif param == "shader":
+                self.shader = self.__create_shader(value)
 
         self.set_default_values(image_config)
 
@@ -1374,7 +1458,7 @@ class ImageLayer:
         new_layer_state: dict
             Dictionary with the new configuration of the layer state.
         """
-        self.__layer_state = dict(new_layer_state)
+        self.__layer_state = new_layer_state.copy()
 
 
 class NgLayer:
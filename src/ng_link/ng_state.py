@@ -1,20 +1,129 @@
 """
 Class to represent a configuration state to visualize data in neuroglancer
 """
-import re
+import functools
+import multiprocessing
+import os
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Iterator, List, Optional, Tuple, Union
+from xml.etree import ElementTree
 
 import numpy as np
-import xmltodict
-from pint import UnitRegistry
 
 from .ng_layer import NgLayer
 from .utils import utils
 
+try:
+    # Optional faster XML parser for large marker files
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 # IO types
 PathLike = Union[str, Path]
 
+# The layer factory is stateless, shared by all the layers
+_NG_LAYER_FACTORY = NgLayer()
+
+# Block size used to read XML files from the cloud
+_XML_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Axis names converted to meters
+_SPATIAL_AXES = frozenset("xyzXYZ")
+
+# Neuroglancer metric for each destination metric
+_NEUROGLANCER_METRICS = {"meters": "m", "seconds": "s"}
+
+# Scale factors of the common units to each destination metric
+_UNIT_SCALES = {
+    "meters": {
+        "meter": 1.0,
+        "meters": 1.0,
+        "m": 1.0,
+        "millimeter": 1e-3,
+        "millimeters": 1e-3,
+        "mm": 1e-3,
+        "micrometer": 1e-6,
+        "micrometers": 1e-6,
+        "micron": 1e-6,
+        "microns": 1e-6,
+        "um": 1e-6,
+        "nanometer": 1e-9,
+        "nanometers": 1e-9,
+        "nm": 1e-9,
+    },
+    "seconds": {
+        "second": 1.0,
+        "seconds": 1.0,
+        "s": 1.0,
+        "millisecond": 1e-3,
+        "milliseconds": 1e-3,
+        "ms": 1e-3,
+        "microsecond": 1e-6,
+        "microseconds": 1e-6,
+        "us": 1e-6,
+        "nanosecond": 1e-9,
+        "nanoseconds": 1e-9,
+        "ns": 1e-9,
+    },
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_unit_registry():
+    """
+    Loads the pint unit registry the first time a unit
+    outside the scale tables is converted. Loading the
+    unit definitions is expensive, so it is shared by
+    all the states.
+
+    Returns
+    ------------------------
+    pint.UnitRegistry
+        Registry with the unit definitions.
+    """
+    from pint import UnitRegistry
+
+    return UnitRegistry()
+
+
+@functools.lru_cache(maxsize=256)
+def _convert_axis(voxel_size: float, unit: str, dest_metric: str) -> Tuple:
+    """
+    Converts a voxel size to the destination metric. Datasets
+    share a few voxel sizes, so the conversions are cached.
+
+    Parameters
+    ------------------------
+    voxel_size: float
+        Voxel size of the axis.
+
+    unit: str
+        Unit of the voxel size.
+
+    dest_metric: str
+        Destination metric, 'meters' or 'seconds'.
+
+    Returns
+    ------------------------
+    Tuple
+        Tuple with the converted quantity and
+        its metric in neuroglancer format.
+    """
+
+    # Converting to desired metric, pint only for uncommon units
+    scale = _UNIT_SCALES[dest_metric].get(unit)
+
+    if scale is not None:
+        dest_value = voxel_size * scale
+
+    else:
+        dest_value = (
+            _get_unit_registry().Quantity(voxel_size, unit).to(dest_metric).m
+        )
+
+    return (dest_value, _NEUROGLANCER_METRICS[dest_metric])
+
 
 class NgState:
     """
@@ -31,6 +140,7 @@ class NgState:
         base_url: Optional[str] = "https://neuroglancer-demo.appspot.com/",
         json_name: Optional[str] = "process_output.json",
         dataset_name: Optional[str] = None,
+        n_workers: Optional[int] = 1,
     ) -> None:
         """
         Class constructor
@@ -53,12 +163,17 @@ class NgState:
             Name of json file with neuroglancer configuration
         dataset_name: Optional[str]
             Name of the dataset. If None, the name of the output_dir directory will be used.
+        n_workers: Optional[int]
+            Number of processes used to create the layers. Useful when
+            there are many layers with large inline annotations.
+            Default 1, layers are created in the current process.
 
         """
 
         self.input_config = input_config
         self.output_json = Path(self.__fix_output_json_path(output_dir))
         self.verbose = verbose
+        self.n_workers = n_workers
         self.mount_service = mount_service
         self.bucket_path = bucket_path
         self.base_url = base_url
@@ -66,12 +181,16 @@ class NgState:
         # Component after S3 bucket and before filename in the "ng_link" field of the output JSON
         self.dataset_name = dataset_name
         if self.dataset_name is None:
-            self.dataset_name = Path(self.output_json).stem
+            self.dataset_name = self.output_json.stem
 
         # State and layers attributes
         self.__state = {}
+        # The state is rebuilt only after an attribute changes
+        self.__state_dirty = True
         self.__dimensions = {}
         self.__layers = []
+        self.__show_axis_lines = True
+        self.__show_scale_bar = True
 
         # Initialize principal attributes
         self.initialize_attributes(self.input_config)
@@ -90,17 +209,15 @@ class NgState:
         str
             String with the fixed outputh path.
         """
-        output_json = Path(
-            str(output_json)
+        return (
+            os.fspath(output_json)
             .replace("/home/jupyter/", "")
             .replace("////", "//")
         )
 
-        return output_json
-
     def __unpack_axis(
         self, axis_values: dict, dest_metric: Optional[str] = "meters"
-    ) -> List:
+    ) -> Tuple:
         """
         Unpack axis voxel sizes converting them to meters.
         neuroglancer uses meters by default.
@@ -120,32 +237,21 @@ class NgState:
 
         Returns
         ------------------------
-        List
-            List with two values, the converted quantity
+        Tuple
+            Tuple with two values, the converted quantity
             and it's metric in neuroglancer format.
         """
 
-        if dest_metric not in ["meters", "seconds"]:
+        if dest_metric not in _NEUROGLANCER_METRICS:
             raise NotImplementedError(
                 f"{dest_metric} has not been implemented"
             )
 
-        # Converting to desired metric
-        unit_register = UnitRegistry()
-        quantity = (
-            axis_values["voxel_size"] * unit_register[axis_values["unit"]]
-        )
-        dest_quantity = quantity.to(dest_metric)
-
-        # Neuroglancer metric
-        neuroglancer_metric = None
-        if dest_metric == "meters":
-            neuroglancer_metric = "m"
-
-        elif dest_metric == "seconds":
-            neuroglancer_metric = "s"
+        voxel_size = axis_values["voxel_size"]
+        unit = axis_values["unit"]
 
-        return [dest_quantity.m, neuroglancer_metric]
+        # The cached tuple is shared by the axes with the same voxel size
+        return _convert_axis(voxel_size, unit, dest_metric)
 
     @property
     def dimensions(self) -> dict:
@@ -181,20 +287,18 @@ class NgState:
                 f"Dimensions accepts only dict. Received: {new_dimensions}"
             )
 
-        regex_axis = r"([x-zX-Z])$"
+        dims = self.__dimensions
+        unpack_axis = self.__unpack_axis
 
         for axis, axis_values in new_dimensions.items():
-            if re.search(regex_axis, axis):
-                self.__dimensions[axis] = self.__unpack_axis(axis_values)
+            if axis in _SPATIAL_AXES:
+                dims[axis] = unpack_axis(axis_values)
             elif axis == "t":
-                self.__dimensions[axis] = self.__unpack_axis(
-                    axis_values, "seconds"
-                )
+                dims[axis] = unpack_axis(axis_values, "seconds")
             elif axis == "c'":
-                self.__dimensions[axis] = [
-                    axis_values["voxel_size"],
-                    axis_values["unit"],
-                ]
+                dims[axis] = (axis_values["voxel_size"], axis_values["unit"])
+
+        self.__state_dirty = True
 
     @property
     def layers(self) -> List[dict]:
@@ -225,41 +329,126 @@ class NgState:
                 f"layers accepts only list. Received value: {layers}"
             )
 
-        for layer in layers:
-            config = {}
+        configs = [self.__build_layer_config(layer) for layer in layers]
+        n_workers = min(self.n_workers or 1, len(configs))
 
-            if layer["type"] == "image":
-                config = {
-                    "image_config": layer,
-                    "mount_service": self.mount_service,
-                    "bucket_path": self.bucket_path,
-                    "output_dimensions": self.dimensions,
-                    "layer_type": layer["type"],
-                }
+        if n_workers > 1:
+            with multiprocessing.Pool(processes=n_workers) as pool:
+                self.__layers.extend(pool.map(create_layer_state, configs))
 
-            elif layer["type"] == "annotation":
-                config = {
-                    "annotation_source": layer["source"],
-                    "annotation_locations": layer["annotations"],
-                    "layer_type": layer["type"],
-                    "output_dimensions": self.dimensions,
-                    "limits": layer["limits"] if "limits" in layer else None,
-                    "mount_service": self.mount_service,
-                    "bucket_path": self.bucket_path,
-                    "layer_name": layer["name"],
-                }
+        else:
+            self.__layers.extend(
+                create_layer_state(config) for config in configs
+            )
 
-            elif layer["type"] == "segmentation":
-                config = {
-                    "segmentation_source": layer["source"],
-                    "tab": layer["tab"],
-                    "layer_name": layer["name"],
-                    "mount_service": self.mount_service,
-                    "bucket_path": self.bucket_path,
-                    "layer_type": layer["type"],
-                }
+        self.__state_dirty = True
+
+    def __build_layer_config(self, layer: dict) -> dict:
+        """
+        Builds the parameters to instantiate a layer
+        based on its type.
+
+        Parameters
+        ------------------------
+        layer: dict
+            Configuration of the layer.
+
+        Raises
+        ------------------------
+        NotImplementedError:
+            Raises if the layer type has not been implemented.
+
+        Returns
+        ------------------------
+        dict
+            Dictionary with the parameters of the layer class.
+        """
 
-            self.__layers.append(NgLayer().create(config).layer_state)
+        config_builder = self._LAYER_CONFIG_BUILDERS.get(layer["type"])
+
+        if config_builder is None:
+            raise NotImplementedError(
+                f"Layer type {layer['type']} has not been implemented"
+            )
+
+        return config_builder(self, layer)
+
+    def __image_layer_config(self, layer: dict) -> dict:
+        """
+        Builds the parameters of an image layer.
+
+        Parameters
+        ------------------------
+        layer: dict
+            Configuration of the image layer.
+
+        Returns
+        ------------------------
+        dict
+            Dictionary with the parameters of the image layer.
+        """
+        return {
+            "image_config": layer,
+            "mount_service": self.mount_service,
+            "bucket_path": self.bucket_path,
+            "output_dimensions": self.dimensions,
+            "layer_type": layer["type"],
+        }
+
+    def __annotation_layer_config(self, layer: dict) -> dict:
+        """
+        Builds the parameters of an annotation layer.
+
+        Parameters
+        ------------------------
+        layer: dict
+            Configuration of the annotation layer.
+
+        Returns
+        ------------------------
+        dict
+            Dictionary with the parameters of the annotation layer.
+        """
+        return {
+            "annotation_source": layer["source"],
+            "annotation_locations": layer["annotations"],
+            "layer_type": layer["type"],
+            "output_dimensions": self.dimensions,
+            "limits": layer.get("limits"),
+            "mount_service": self.mount_service,
+            "bucket_path": self.bucket_path,
+            "layer_name": layer["name"],
+        }
+
+    def __segmentation_layer_config(self, layer: dict) -> dict:
+        """
+        Builds the parameters of a segmentation layer.
+
+        Parameters
+        ------------------------
+        layer: dict
+            Configuration of the segmentation layer.
+
+        Returns
+        ------------------------
+        dict
+            Dictionary with the parameters of the segmentation layer.
+        """
+        return {
+            "segmentation_source": layer["source"],
+            "tab": layer["tab"],
+            "layer_name": layer["name"],
+            "mount_service": self.mount_service,
+            "bucket_path": self.bucket_path,
+            "layer_type": layer["type"],
+        }
+
+    # Layer type and the method that builds its parameters
+    _LAYER_CONFIG_BUILDERS = {
+        "image": __image_layer_config,
+        "annotation": __annotation_layer_config,
+        "segmentation": __segmentation_layer_config,
+    }
 
     @property
     def state(self, new_state: dict) -> None:
@@ -277,7 +466,10 @@ class NgState:
     @state.getter
     def state(self) -> dict:
         """
-        Property getter of state.
+        Property getter of state. The state is cached
+        until the dimensions, layers or display options
+        are set again. The link always follows the
+        current attributes.
 
         Returns
         ------------------------
@@ -285,20 +477,21 @@ class NgState:
             Dictionary with the actual layer state.
         """
 
-        actual_state = {}
-        actual_state["ng_link"] = self.get_url_link()
-        actual_state["dimensions"] = {}
-
-        # Getting actual state for all attributes
-        for axis, value_list in self.__dimensions.items():
-            actual_state["dimensions"][axis] = value_list
+        if not self.__state_dirty and self.__state:
+            # Public attributes used by the link are not tracked
+            self.__state["ng_link"] = self.get_url_link()
+            return self.__state
 
-        actual_state["layers"] = self.__layers
+        self.__state = {
+            "ng_link": self.get_url_link(),
+            "dimensions": dict(self.__dimensions),
+            "layers": self.__layers,
+            "showAxisLines": self.__show_axis_lines,
+            "showScaleBar": self.__show_scale_bar,
+        }
+        self.__state_dirty = False
 
-        actual_state["showAxisLines"] = True
-        actual_state["showScaleBar"] = True
-
-        return actual_state
+        return self.__state
 
     def initialize_attributes(self, input_config: dict) -> None:
         """
@@ -318,9 +511,6 @@ class NgState:
         # Initializing layers
         self.layers = input_config["layers"]
 
-        # Initializing state
-        self.__state = self.state
-
         for key, val in input_config.items():
             if key == "showAxisLines":
                 self.show_axis_lines = val
@@ -338,7 +528,7 @@ class NgState:
         bool
             Boolean with the show axis lines value.
         """
-        return self.__state["showAxisLines"]
+        return self.__show_axis_lines
 
     @show_axis_lines.setter
     def show_axis_lines(self, new_show_axis_lines: bool) -> None:
@@ -355,7 +545,8 @@ class NgState:
         ValueError:
             If the parameter is not an boolean.
         """
-        self.__state["showAxisLines"] = bool(new_show_axis_lines)
+        self.__show_axis_lines = bool(new_show_axis_lines)
+        self.__state_dirty = True
 
     @property
     def show_scale_bar(self) -> bool:
@@ -367,7 +558,7 @@ class NgState:
         bool
             Boolean with the show scale bar value.
         """
-        return self.__state["showScaleBar"]
+        return self.__show_scale_bar
 
     @show_scale_bar.setter
     def show_scale_bar(self, new_show_scale_bar: bool) -> None:
@@ -384,7 +575,32 @@ class NgState:
         ValueError:
             If the parameter is not an boolean.
         """
-        self.__state["showScaleBar"] = bool(new_show_scale_bar)
+        self.__show_scale_bar = bool(new_show_scale_bar)
+        self.__state_dirty = True
+
+    def __current_state(self, update_state: bool) -> dict:
+        """
+        Gets the state that will be saved.
+
+        Parameters
+        ------------------------
+        update_state: bool
+            Rebuilds the neuroglancer state with dimensions
+            and layers in case they were modified in place
+            after the state was built. Changes made through
+            the setters are always included.
+
+        Returns
+        ------------------------
+        dict
+            Dictionary with the actual layer state.
+        """
+
+        # In-place changes are not tracked by the state cache
+        if update_state:
+            self.__state_dirty = True
+
+        return self.state
 
     def save_state_as_json(self, update_state: Optional[bool] = False) -> None:
         """
@@ -393,20 +609,90 @@ class NgState:
         Parameters
         ------------------------
         update_state: Optional[bool]
-            Updates the neuroglancer state with dimensions
-            and layers in case they were changed using
-            class methods. Default False
+            Rebuilds the state before saving it,
+            see __current_state. Default False
         """
 
-        if update_state:
-            self.__state = self.state
+        final_path = self.output_json.joinpath(self.json_name)
+        utils.save_dict_as_json(
+            final_path,
+            self.__current_state(update_state),
+            verbose=self.verbose,
+        )
 
-        final_path = Path(self.output_json).joinpath(self.json_name)
-        utils.save_dict_as_json(final_path, self.__state, verbose=self.verbose)
+    def save_state_as_json_streaming(
+        self, update_state: Optional[bool] = False
+    ) -> None:
+        """
+        Saves a neuroglancer state as json writing one layer
+        at a time. Useful to reduce the memory peak of states
+        with large annotation layers.
+
+        Parameters
+        ------------------------
+        update_state: Optional[bool]
+            Rebuilds the state before saving it,
+            see __current_state. Default False
+        """
+
+        final_path = self.output_json.joinpath(self.json_name)
+        utils.save_dict_as_json_streaming(
+            final_path,
+            self.__current_state(update_state),
+            "layers",
+            verbose=self.verbose,
+        )
+
+    def save_state_to_s3(
+        self,
+        update_state: Optional[bool] = False,
+        s3_client: Optional[object] = None,
+    ) -> None:
+        """
+        Uploads a neuroglancer state as json directly to the
+        location the neuroglancer link points to, without
+        writing it to disk first.
+
+        Parameters
+        ------------------------
+        update_state: Optional[bool]
+            Rebuilds the state before saving it,
+            see __current_state. Default False
+        s3_client: Optional[object]
+            boto3 S3 client used for the upload. If None,
+            a new client is created.
+
+        Raises
+        ------------------------
+        NotImplementedError:
+            Raises if the mount service is not 's3'.
+        """
+
+        if self.mount_service != "s3":
+            raise NotImplementedError(
+                f"Uploading to {self.mount_service} has not been implemented"
+            )
+
+        bucket_name, _, prefix = str(self.bucket_path).partition("/")
+        key = "/".join(
+            part
+            for part in [prefix.strip("/"), self.dataset_name, self.json_name]
+            if part
+        )
+
+        utils.upload_dict_as_json_to_s3(
+            self.__current_state(update_state),
+            bucket_name,
+            key,
+            s3_client=s3_client,
+            verbose=self.verbose,
+        )
 
     def get_url_link(self) -> str:
         """
         Creates the neuroglancer link based on where the json will be written.
+        The link is built from the current attributes, since they are public
+        and can change after the state is instantiated.
 
         Returns
         ------------------------
@@ -414,11 +700,118 @@ class NgState:
             Neuroglancer url to visualize data.
         """
 
-        json_path = f"{self.mount_service}://{self.bucket_path}/{self.dataset_name}/{self.json_name}"
+        return (
+            f"{self.base_url}#!{self.mount_service}://{self.bucket_path}"
+            f"/{self.dataset_name}/{self.json_name}"
+        )
+
 
-        link = f"{self.base_url}#!{json_path}"
+def create_layer_state(config: dict) -> dict:
+    """
+    Creates the state of a single layer. Defined at module
+    level so it can be sent to worker processes.
+
+    Parameters
+    -----------------
+    config: dict
+        Parameters of the layer class.
+
+    Returns
+    -----------------
+    dict
+        Dictionary with the layer state.
+    """
 
-        return link
+    return _NG_LAYER_FACTORY.create(config).layer_state
+
+
+def iterate_xml_markers(
+    path: PathLike, encoding: str = "utf-8"
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    Generator that streams the marker locations from the
+    cell segmentation capsule XML without building the
+    whole XML tree.
+
+    Parameters
+    -----------------
+
+    Path: PathLike
+        Path where the XML is stored. Cloud paths
+        (e.g. s3://bucket/cells.xml) are read with fsspec
+        using readahead blocks, so the download overlaps
+        with the parsing.
+
+    encoding: str
+        XML encoding. Default: "utf-8"
+
+    Returns
+    -----------------
+    Iterator[Tuple[str, str, str]]
+        Iterator with the (x, y, z) location of each point.
+    """
+
+    path = str(path)
+
+    if "://" in path:
+        import fsspec
+
+        # Readahead blocks for S3, other services use their defaults
+        storage_options = {}
+        if path.startswith("s3://"):
+            storage_options = {
+                "default_block_size": _XML_BLOCK_SIZE,
+                "default_cache_type": "readahead",
+            }
+
+        xml_file = fsspec.open(path, mode="rb", **storage_options)
+
+    else:
+        xml_file = open(path, "rb")
+
+    with xml_file as xml_reader:
+        if lxml_etree is not None:
+            # lxml filters the marker tags while parsing
+            for _, element in lxml_etree.iterparse(
+                xml_reader, tag="Marker", encoding=encoding
+            ):
+                yield (
+                    element.findtext("MarkerX"),
+                    element.findtext("MarkerY"),
+                    element.findtext("MarkerZ"),
+                )
+
+                # Read markers are dropped, so Marker_Type does not grow
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        else:
+            # Open elements, the last one is the parent of the next element
+            parents = []
+
+            for event, element in ElementTree.iterparse(
+                xml_reader,
+                events=("start", "end"),
+                parser=ElementTree.XMLParser(encoding=encoding),
+            ):
+                if event == "start":
+                    parents.append(element)
+                    continue
+
+                parents.pop()
+
+                if element.tag != "Marker":
+                    continue
+
+                yield (
+                    element.findtext("MarkerX"),
+                    element.findtext("MarkerY"),
+                    element.findtext("MarkerZ"),
+                )
+
+                # Read markers are detached, so Marker_Type does not grow
+                parents[-1].remove(element)
 
 
 def get_points_from_xml(path: PathLike, encoding: str = "utf-8") -> List[dict]:
@@ -438,28 +831,49 @@ def get_points_from_xml(path: PathLike, encoding: str = "utf-8") -> List[dict]:
     Returns
     -----------------
     List[dict]
-        List with the location of the points.
+        List with the integer location of the points.
     """
 
-    with open(path, "r", encoding=encoding) as xml_reader:
-        xml_file = xml_reader.read()
+    # Coordinates are converted to integers while parsing
+    return [
+        {"x": x, "y": y, "z": z}
+        for x, y, z in get_points_from_xml_array(path, encoding).tolist()
+    ]
 
-    xml_dict = xmltodict.parse(xml_file)
-    cell_data = xml_dict["CellCounter_Marker_File"]["Marker_Data"][
-        "Marker_Type"
-    ]["Marker"]
 
-    new_cell_data = []
-    for cell in cell_data:
-        new_cell_data.append(
-            {
-                "x": cell["MarkerX"],
-                "y": cell["MarkerY"],
-                "z": cell["MarkerZ"],
-            }
-        )
+def get_points_from_xml_array(
+    path: PathLike, encoding: str = "utf-8"
+) -> np.ndarray:
+    """
+    Function to parse the points from the
+    cell segmentation capsule into an array.
+
+    Parameters
+    -----------------
+
+    Path: PathLike
+        Path where the XML is stored.
+
+    encoding: str
+        XML encoding. Default: "utf-8"
+
+    Returns
+    -----------------
+    np.ndarray
+        Array with shape (N, 3) and the (x, y, z)
+        location of the points.
+    """
+
+    points = np.fromiter(
+        (
+            int(coordinate)
+            for point in iterate_xml_markers(path, encoding)
+            for coordinate in point
+        ),
+        dtype=np.int32,
+    )
 
-    return new_cell_data
+    return points.reshape(-1, 3)
 
 
 def smartspim_example():
@@ -802,7 +1216,7 @@ def dispim_example():
         return multisource_layer
 
     # t  c  z  y  x  T
-    ng_affine_transform = np.zeros((5, 6), np.float16)
+    ng_affine_transform = np.zeros((5, 6), np.float64)
     np.fill_diagonal(ng_affine_transform, 1)
 
     theta = 45
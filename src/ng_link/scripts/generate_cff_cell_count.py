@@ -2,12 +2,16 @@
 Script to generate CCF + cell counts
 """
 
-import json
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Union
 
 import boto3
+import numpy as np
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 # import neuroglancer
 import pandas as pd
@@ -15,11 +19,41 @@ import pandas as pd
 from ng_link import NgState
 
 # from ng_link.ng_layer import generate_precomputed_cells
-from ng_link.ng_state import get_points_from_xml
+from ng_link.ng_state import get_points_from_xml_array
+from ng_link.utils import utils
 
 # IO types
 PathLike = Union[str, Path]
 
+# Parallel CCF downloads and multipart ranges per download
+_CCF_DOWNLOAD_WORKERS = 16
+_CCF_PART_CONCURRENCY = 4
+
+# CCF id-struct pairings shipped with the script
+_CCF_REFERENCE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "ccf_ref.csv"
+)
+
+
+@functools.lru_cache(maxsize=8)
+def load_ccf_reference(ccf_reference_path: str) -> pd.DataFrame:
+    """
+    Loads the CCF id-struct pairings. The csv does not change
+    between calls, so it is parsed once per path.
+
+    Parameters
+    ----------
+    ccf_reference_path: str
+        Path to the csv with the id and struct columns
+
+    Returns
+    ----------
+    pd.DataFrame
+        Dataframe with the CCF id-struct pairings. It is
+        shared between calls and should not be modified.
+    """
+    return pd.read_csv(ccf_reference_path)
+
 
 def get_ccf(
     out_path: str,
@@ -42,28 +76,74 @@ def get_ccf(
     # location of the data from tissueCyte,
     # but can get our own and change to aind-open-data
 
-    s3_resource = boto3.resource("s3")
-    bucket = s3_resource.Bucket(bucket_name)
+    # Every worker may have all of its parts in flight at once
+    s3_client = boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=_CCF_DOWNLOAD_WORKERS * _CCF_PART_CONCURRENCY,
+            connect_timeout=3,
+            read_timeout=30,
+            retries={"mode": "adaptive", "total_max_attempts": 5},
+        ),
+    )
+
+    # Multipart range requests for the large CCF files
+    transfer_config = TransferConfig(
+        multipart_threshold=8 * 1024 * 1024,
+        multipart_chunksize=16 * 1024 * 1024,
+        max_concurrency=_CCF_PART_CONCURRENCY,
+        use_threads=True,
+    )
 
-    for obj in bucket.objects.filter(Prefix=s3_folder):
-        target = os.path.join(out_path, os.path.relpath(obj.key, s3_folder))
+    def download_object(obj_key: str, target: str) -> None:
+        """
+        Downloads a single object of the CCF folder
+
+        Parameters
+        ----------
+        obj_key: str
+            Key of the object in the bucket
+        target: str
+            Local path where the object will be saved
+        """
+        s3_client.download_file(
+            bucket_name, obj_key, target, Config=transfer_config
+        )
 
-        # dont currently need 10um data so we should skip
-        if "10000_10000_10000" in obj.key:
-            continue
+    # Listing all the pages before downloading
+    paginator = s3_client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=bucket_name,
+        Prefix=s3_folder,
+        PaginationConfig={"PageSize": 1000},
+    )
 
-        if not os.path.exists(os.path.dirname(target)):
-            os.makedirs(os.path.dirname(target))
+    # dont currently need 10um data and dont try and download folders
+    obj_keys = [
+        obj["Key"]
+        for page in pages
+        for obj in page.get("Contents", [])
+        if not obj["Key"].endswith("/")
+        and "10000_10000_10000" not in obj["Key"]
+    ]
+    targets = [
+        os.path.join(out_path, os.path.relpath(obj_key, s3_folder))
+        for obj_key in obj_keys
+    ]
 
-        # dont try and download folders
-        if obj.key[-1] == "/":
-            continue
+    for target_folder in {os.path.dirname(target) for target in targets}:
+        os.makedirs(target_folder, exist_ok=True)
 
-        bucket.download_file(obj.key, target)
+    # Downloads are latency bound, overlapping the requests
+    with ThreadPoolExecutor(max_workers=_CCF_DOWNLOAD_WORKERS) as executor:
+        # Consuming the results raises the download errors
+        list(executor.map(download_object, obj_keys, targets))
 
 
 def generate_cff_cell_counting(
-    input_path: str, output_path: str, ccf_reference_path: Optional[str] = None
+    input_path: str,
+    output_path: PathLike,
+    ccf_reference_path: Optional[str] = None,
 ):
     """
     Function for creating segmentation layer with cell counts
@@ -74,45 +154,46 @@ def generate_cff_cell_counting(
     input_path: str
         path to file cell_count_by_region.csv
         generated from "aind-smartspim-quantification"
-    output_path: str
+    output_path: PathLike
         path to where you want to save the precomputed files
     """
     # check that save path exists and if not create
-    if not os.path.exists(output_path):
-        os.mkdir(output_path)
+    output_path = Path(output_path)
+    segment_properties_path = output_path.joinpath("segment_properties")
+    segment_properties_path.mkdir(parents=True, exist_ok=True)
 
     df_count = pd.read_csv(input_path, index_col=0)
-    include = list(df_count["Structure"].values)
 
     # get CCF id-struct pairings
     if ccf_reference_path is None:
-        ccf_reference_path = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "ccf_ref.csv"
-        )
+        ccf_reference_path = _CCF_REFERENCE_PATH
 
-    df_ccf = pd.read_csv(ccf_reference_path)
+    df_ccf = load_ccf_reference(str(ccf_reference_path))
 
-    keep_ids = []
-    keep_struct = []
-    for r, irow in df_ccf.iterrows():
-        if irow["struct"] in include:
-            keep_ids.append(str(irow["id"]))
-            total = df_count.loc[
-                df_count["Structure"] == irow["struct"], ["Total"]
-            ].values.squeeze()
-            keep_struct.append(irow["struct"] + " cells: " + str(total))
+    # Joining the counted structures keeps the CCF order
+    df_kept = df_ccf.merge(
+        df_count[["Structure", "Total"]],
+        how="inner",
+        left_on="struct",
+        right_on="Structure",
+    )
+    keep_ids = df_kept["id"].astype(str).tolist()
+    keep_struct = (
+        df_kept["struct"] + " cells: " + df_kept["Total"].astype(str)
+    ).tolist()
 
     # download ccf procomputed format
     get_ccf(output_path)
 
     # currently using 25um resolution so need to drop 10um data or NG finicky
-    with open(os.path.join(output_path, "info"), "r") as f:
-        info_file = json.load(f)
+    info_path = output_path.joinpath("info")
+    info_file = utils.read_json_as_dict(info_path)
 
-    info_file["scales"].pop(0)
+    if info_file is None:
+        raise FileNotFoundError(f"CCF info file not found: {info_path}")
 
-    with open(os.path.join(output_path, "info"), "w") as f:
-        json.dump(info_file, f, indent=2)
+    info_file["scales"].pop(0)
+    utils.save_dict_as_json(info_path, info_file)
 
     # build json for segmentation properties
     data = {
@@ -125,22 +206,37 @@ def generate_cff_cell_counting(
         },
     }
 
-    with open(
-        os.path.join(output_path, "segment_properties/info"), "w"
-    ) as outfile:
-        json.dump(data, outfile, indent=2)
+    utils.save_dict_as_json(segment_properties_path.joinpath("info"), data)
 
 
-def generate_25_um_ccf_cells(params: dict, micron_res: int = 25):
+def generate_25_um_ccf_cells(
+    params: dict, micron_res: int = 25, shuffle_cells: bool = False
+):
     """
     Generates the visualization link for the
     CCF + Cell counting in the 25 um resolution
+
+    Parameters
+    -----------------
+
+    params: dict
+        Paths of the inputs and outputs
+    micron_res: int
+        Resolution of the CCF in microns
+    shuffle_cells: bool
+        If True, the cells are written to the precomputed
+        format in a random order, so neuroglancer shows a
+        random subset when it limits the displayed points
     """
     # Generating CCF and cell counting precomputed format
 
-    # Get cells from XML
-    cells = get_points_from_xml(params["cells_precomputed"]["xml_path"])
-    # cells = random.shuffle(cells)
+    # Get cells from XML, (x, y, z) rows written to precomputed
+    cells = get_points_from_xml_array(params["cells_precomputed"]["xml_path"])
+
+    if shuffle_cells:
+        # Shuffling the rows, random.shuffle returns None
+        rng = np.random.default_rng()
+        cells = cells[rng.permutation(len(cells))]
 
     generate_cff_cell_counting(
         params["ccf_cells_precomputed"]["input_path"],
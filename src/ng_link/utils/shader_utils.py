@@ -25,24 +25,14 @@ def create_monochrome_shader(color: str, emitter: str, vec: str) -> str:
         String with the shader configuration for neuroglancer.
     """
 
-    # Add all necessary ui controls here
-    ui_controls = [
-        f'#uicontrol {vec} color color(default="{color}")',
-        "#uicontrol invlerp normalized",
-    ]
-
-    # color emitter
-    emit_color = (
-        "void main() {\n" + f"emit{emitter}(color * normalized());" + "\n}"
+    # ui controls followed by the color emitter
+    return (
+        f'#uicontrol {vec} color color(default="{color}")\n'
+        "#uicontrol invlerp normalized\n"
+        "void main() {\n"
+        f"emit{emitter}(color * normalized());\n"
+        "}"
     )
-    shader_string = ""
-
-    for ui_control in ui_controls:
-        shader_string += ui_control + "\n"
-
-    shader_string += emit_color
-
-    return shader_string
 
 
 def create_rgb_shader(
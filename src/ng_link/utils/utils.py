@@ -1,15 +1,23 @@
 """
 Utility functions
 """
+import io
 import json
 import os
 import shutil
 import subprocess
-from pathlib import Path
-from typing import Optional, Union, List
+from pathlib import Path, PurePath
+from typing import TYPE_CHECKING, Optional, Union, List
 
-import boto3
-import pandas as pd
+try:
+    # Optional faster json encoder for large states
+    import orjson
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    # boto3 and pandas are slow to import, loaded where they are used
+    import boto3
 
 # IO types
 PathLike = Union[str, Path]
@@ -165,7 +173,13 @@ def save_dict_as_json(
     filename: str, dictionary: dict, verbose: Optional[bool] = False
 ) -> None:
     """
-    Saves a dictionary as a json file.
+    Saves a dictionary as a json file. If orjson is installed
+    it is used to encode the dictionary, otherwise the json
+    module is used. Both indent with 2 spaces and convert keys
+    to strings, so the files decode to the same values. The
+    text can still differ: orjson writes the shortest float
+    form (1.8e-6 instead of 1.8e-06), non-ASCII characters
+    without escaping them, and NaN or Infinity as null.
 
     Parameters
     ------------------------
@@ -188,16 +202,192 @@ def save_dict_as_json(
                 # TODO fix the \\ encode problem in dump
                 dictionary[key] = str(value)
 
-    with open(filename, "w") as json_file:
-        json.dump(dictionary, json_file, indent=4)
+    if orjson is not None:
+        with open(filename, "wb") as json_file:
+            json_file.write(
+                orjson.dumps(
+                    dictionary,
+                    option=orjson.OPT_INDENT_2
+                    | orjson.OPT_NON_STR_KEYS
+                    | orjson.OPT_SERIALIZE_NUMPY,
+                )
+            )
+
+    else:
+        with open(filename, "w") as json_file:
+            json.dump(dictionary, json_file, indent=2)
 
     if verbose:
         print(f"- Json file saved: {filename}")
 
 
+def encode_path(value: object) -> str:
+    """
+    Encodes the paths the json encoders do not support.
+
+    Parameters
+    ------------------------
+    value: object
+        Value the json encoder could not encode.
+
+    Raises
+    ------------------------
+    TypeError:
+        If the value is not a path.
+
+    Returns
+    ------------------------
+    str:
+        String with the path.
+    """
+
+    if isinstance(value, PurePath):
+        return str(value)
+
+    raise TypeError(
+        f"Object of type {type(value).__name__} is not JSON serializable"
+    )
+
+
+def encode_json(value: object) -> bytes:
+    """
+    Encodes a value as compact json, with orjson if it is
+    installed or with the json module otherwise. Values are
+    encoded as in save_dict_as_json.
+
+    Parameters
+    ------------------------
+    value: object
+        Value to encode. Paths are encoded as strings.
+
+    Raises
+    ------------------------
+    TypeError:
+        If the value can not be encoded as json.
+
+    Returns
+    ------------------------
+    bytes:
+        Encoded json value.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=encode_path,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
+
+    return json.dumps(value, default=encode_path).encode()
+
+
+def save_dict_as_json_streaming(
+    filename: str,
+    dictionary: dict,
+    stream_key: str,
+    verbose: Optional[bool] = False,
+) -> None:
+    """
+    Saves a dictionary as a json file writing the elements
+    of one of its lists one at a time. Only one element is
+    encoded in memory at once, instead of the whole dictionary.
+
+    Parameters
+    ------------------------
+    filename: str
+        Name of the json file.
+    dictionary: dict
+        Dictionary that will be saved as json.
+    stream_key: str
+        Key of the list whose elements are written one by one.
+    verbose: Optional[bool]
+        True if you want to print the path where the file was saved.
+
+    """
+
+    with open(filename, "wb") as json_file:
+        json_file.write(b"{")
+
+        for key_idx, (key, value) in enumerate(dictionary.items()):
+            if key_idx:
+                json_file.write(b",")
+
+            json_file.write(b"\n" + encode_json(str(key)) + b": ")
+
+            if key != stream_key:
+                json_file.write(encode_json(value))
+                continue
+
+            json_file.write(b"[")
+
+            for element_idx, element in enumerate(value):
+                if element_idx:
+                    json_file.write(b",")
+
+                json_file.write(b"\n" + encode_json(element))
+
+            json_file.write(b"\n]")
+
+        json_file.write(b"\n}\n")
+
+    if verbose:
+        print(f"- Json file saved: {filename}")
+
+
+def upload_dict_as_json_to_s3(
+    dictionary: dict,
+    bucket_name: str,
+    key: str,
+    s3_client: Optional["boto3.client"] = None,
+    verbose: Optional[bool] = False,
+) -> None:
+    """
+    Uploads a dictionary as a json file directly to S3,
+    using multipart uploads for large dictionaries.
+
+    Parameters
+    ------------------------
+    dictionary: dict
+        Dictionary that will be saved as json.
+    bucket_name: str
+        Name of the S3 bucket.
+    key: str
+        Key of the json file in the bucket.
+    s3_client: Optional[boto3.client]
+        S3 client used to upload the file. If None,
+        a new client is created.
+    verbose: Optional[bool]
+        True if you want to print the path where the file was saved.
+
+    """
+
+    if s3_client is None:
+        s3_client = create_s3_client()
+
+    from boto3.s3.transfer import TransferConfig
+
+    transfer_config = TransferConfig(
+        multipart_chunksize=8 * 1024 * 1024,
+        max_concurrency=10,
+        use_threads=True,
+    )
+
+    s3_client.upload_fileobj(
+        io.BytesIO(encode_json(dictionary)),
+        bucket_name,
+        key,
+        Config=transfer_config,
+    )
+
+    if verbose:
+        print(f"- Json file uploaded: s3://{bucket_name}/{key}")
+
+
 def read_json_as_dict(filepath: str) -> dict:
     """
-    Reads a json as dictionary.
+    Reads a json as dictionary. If orjson is installed
+    it is used to decode the file, except for files with
+    the NaN or Infinity values the json module writes.
 
     Parameters
     ------------------------
@@ -214,8 +404,19 @@ def read_json_as_dict(filepath: str) -> dict:
     dictionary = None
 
     if os.path.exists(filepath):
-        with open(filepath) as json_file:
-            dictionary = json.load(json_file)
+        with open(filepath, "rb") as json_file:
+            json_bytes = json_file.read()
+
+        if orjson is not None:
+            try:
+                dictionary = orjson.loads(json_bytes)
+
+            except orjson.JSONDecodeError:
+                # orjson rejects NaN and Infinity
+                dictionary = json.loads(json_bytes)
+
+        else:
+            dictionary = json.loads(json_bytes)
 
     return dictionary
 
@@ -241,7 +442,7 @@ def save_string_to_txt(txt: str, filepath: PathLike, mode="w") -> None:
         file.write(txt + "\n")
 
 
-def create_s3_client() -> boto3.client:
+def create_s3_client() -> "boto3.client":
     """
     Create and return a boto3 S3 client.
 
@@ -250,11 +451,13 @@ def create_s3_client() -> boto3.client:
     boto3.Client
         A boto3 S3 client object.
     """
+    import boto3
+
     return boto3.client('s3')
 
 
 def list_folders_s3(
-        s3_client: boto3.client,
+        s3_client: "boto3.client",
         bucket_name: str,
         prefix: str
 ) -> list:
@@ -297,6 +500,8 @@ def save_to_csv(data: List[dict], file_path: str) -> str:
     str
         The path of the saved CSV file.
     """
+    import pandas as pd
+
     df = pd.DataFrame(data)
     df.to_csv(file_path, index=False)
     return file_path
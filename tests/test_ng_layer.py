@@ -1,7 +1,21 @@
 """Tests ng layer class methods."""
+import json
+import os
+import struct
+import tempfile
 import unittest
+from unittest import mock
 
-from ng_link.ng_layer import ImageLayer
+import neuroglancer
+import numpy as np
+
+from ng_link.ng_layer import (
+    ImageLayer,
+    generate_precomputed_cells,
+    helper_create_ng_translation_matrices,
+    helper_create_ng_translation_matrix,
+    helper_reverse_dictionary,
+)
 
 
 class NgLayerTest(unittest.TestCase):
@@ -80,6 +94,325 @@ class NgLayerTest(unittest.TestCase):
             output_dimensions=dict(),
         )
 
+    def test_reverse_dictionary(self):
+        """
+        Test that helper_reverse_dictionary reverses the key order
+        """
+        dimensions = {"x": [1.0, "m"], "y": [2.0, "m"], "z": [3.0, "m"]}
+
+        result = helper_reverse_dictionary(dimensions)
+
+        self.assertEqual(list(result.keys()), ["z", "y", "x"])
+        self.assertEqual(result, dimensions)
+
+    def test_translation_matrix(self):
+        """
+        Test that the translation matrix places the deltas
+        in the last column of the x, y and z rows
+        """
+        result = helper_create_ng_translation_matrix(
+            delta_x=-14192, delta_y=-19684.000456947142, delta_z=3
+        )
+
+        expected = [
+            [1.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+            [0.0, 1.0, 0.0, 0.0, 0.0, 0.0],
+            [0.0, 0.0, 1.0, 0.0, 0.0, 3.0],
+            [0.0, 0.0, 0.0, 1.0, 0.0, -19684.000456947142],
+            [0.0, 0.0, 0.0, 0.0, 1.0, -14192.0],
+        ]
+
+        self.assertEqual(result, expected)
+
+    def test_translation_matrix_too_small(self):
+        """
+        Test that the translation matrix fails when there
+        are not enough rows for the deltas
+        """
+        self.assertRaises(
+            ValueError, helper_create_ng_translation_matrix, n_rows=3
+        )
+
+    def test_translation_matrices_batch(self):
+        """
+        Test that the batched translation matrices match
+        the ones built one at a time
+        """
+        deltas = [[-14192, -10640, 0], [-26255.200652782467, -19684.0, 2]]
+
+        result = helper_create_ng_translation_matrices(deltas)
+
+        expected = [
+            helper_create_ng_translation_matrix(*delta) for delta in deltas
+        ]
+
+        self.assertEqual(result, expected)
+        self.assertEqual(helper_create_ng_translation_matrices([]), [])
+
+    def test_image_layer_multiple_sources(self):
+        """
+        Test that ImageLayer sets the transform of each source
+        """
+        image_config = {
+            "source": [
+                {
+                    "url": "s3://bucket/tile_0.zarr",
+                    "transform_matrix": {
+                        "delta_x": 1,
+                        "delta_y": 2,
+                        "delta_z": 3,
+                    },
+                },
+                {
+                    "url": "tile_1.zarr",
+                    "transform_matrix": [[1.0, 0.0], [0.0, 1.0]],
+                },
+                {"url": "tile_2.zarr", "transform_matrix": None},
+            ],
+        }
+        output_dimensions = {"x": [1e-6, "m"], "y": [1e-6, "m"]}
+
+        layer = ImageLayer(
+            image_config=image_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dimensions=output_dimensions,
+        )
+
+        sources = layer.layer_state["source"]
+
+        self.assertEqual(sources[0]["url"], "zarr://s3://bucket/tile_0.zarr")
+        self.assertEqual(
+            sources[0]["transform"]["matrix"],
+            helper_create_ng_translation_matrix(1, 2, 3),
+        )
+        self.assertEqual(
+            list(sources[0]["transform"]["outputDimensions"]), ["y", "x"]
+        )
+        self.assertEqual(
+            sources[1]["url"], "zarr://s3://silly/bucket/tile_1.zarr"
+        )
+        self.assertEqual(
+            sources[1]["transform"]["matrix"], [[1.0, 0.0], [0.0, 1.0]]
+        )
+        self.assertNotIn("transform", sources[2])
+        self.assertIsNone(sources[2]["transform_matrix"])
+
+    def test_image_layer_without_output_dimensions(self):
+        """
+        Test that ImageLayer can be built without output dimensions
+        """
+        layer = ImageLayer(
+            image_config={"source": "bogus.zarr"},
+            mount_service="s3",
+            bucket_path="silly/bucket",
+        )
+
+        self.assertIsNone(layer.output_dimensions)
+        self.assertEqual(
+            layer.layer_state["source"], "zarr://s3://silly/bucket/bogus.zarr"
+        )
+
+        layer = ImageLayer(
+            image_config={
+                "source": [{"url": "bogus.zarr", "transform_matrix": [[1.0]]}]
+            },
+            mount_service="s3",
+            bucket_path="silly/bucket",
+        )
+
+        self.assertEqual(
+            layer.layer_state["source"][0]["transform"], {"matrix": [[1.0]]}
+        )
+
+    def test_image_layer_local_source_normalized(self):
+        """
+        Test that local image sources are normalized before
+        pointing them to the mount service
+        """
+        sources = {
+            "data.zarr/": "zarr://s3://silly/bucket/data.zarr",
+            "./images//data.zarr": "zarr://s3://silly/bucket/images/data.zarr",
+        }
+
+        for source, expected in sources.items():
+            layer = ImageLayer(
+                image_config={"source": source},
+                mount_service="s3",
+                bucket_path="silly/bucket",
+            )
+
+            self.assertEqual(layer.layer_state["source"], expected)
+
+    def test_image_layer_empty_sources_with_name(self):
+        """
+        Test that ImageLayer accepts an empty list of
+        sources when the layer name is given
+        """
+        layer = ImageLayer(
+            image_config={"source": [], "name": "empty"},
+            mount_service="s3",
+            bucket_path="silly/bucket",
+        )
+
+        self.assertEqual(layer.layer_state["source"], [])
+        self.assertEqual(layer.layer_state["name"], "empty")
+
+    def test_image_layer_source_only_defaults(self):
+        """
+        Test that a config with only the source gets the default values
+        """
+        layer = ImageLayer(
+            image_config={"source": "/data/a.zarr"},
+            mount_service="s3",
+            bucket_path="bucket",
+            layer_type="image",
+            output_dimensions={},
+        )
+
+        layer_state = layer.layer_state
+
+        self.assertEqual(layer_state["type"], "image")
+        self.assertEqual(layer_state["name"], "a_1")
+        self.assertEqual(
+            layer_state["shaderControls"], {"normalized": {"range": [0, 200]}}
+        )
+        self.assertTrue(layer_state["visible"])
+
+    def test_image_layer_keeps_input_config(self):
+        """
+        Test that ImageLayer does not modify the given image config
+        """
+        image_config = {"source": "bogus.zarr", "channel": 1}
+
+        layer = ImageLayer(
+            image_config=image_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+        )
+
+        self.assertEqual(image_config, {"source": "bogus.zarr", "channel": 1})
+        self.assertEqual(
+            layer.image_config["source"], "zarr://s3://silly/bucket/bogus.zarr"
+        )
+        self.assertEqual(layer.layer_state["name"], "bogus_2")
+
+    def test_image_layer_zarr_trailing_slash(self):
+        """
+        Test that ImageLayer accepts zarr sources ending with a slash
+        """
+        layer = ImageLayer(
+            image_config={"source": "s3://bucket/bogus.zarr/"},
+            mount_service="s3",
+            bucket_path="silly/bucket",
+        )
+
+        self.assertEqual(
+            layer.layer_state["source"], "zarr://s3://bucket/bogus.zarr/"
+        )
+
+    def test_image_layer_source_failure(self):
+        """
+        Test that ImageLayer fails with an unsupported source type
+        """
+        self.assertRaises(
+            TypeError,
+            ImageLayer,
+            image_config={"source": 42},
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dimensions=dict(),
+        )
+
+
+class GeneratePrecomputedCellsTest(unittest.TestCase):
+    """Tests the precomputed annotation writer."""
+
+    def test_generate_precomputed_cells(self):
+        """
+        Test that the cells are written in the precomputed format
+        """
+        cells = [
+            {"x": 10, "y": 20, "z": 30},
+            {"x": "11", "y": "21", "z": "31"},
+            {"x": 12, "y": 5, "z": 40},
+        ]
+        res = neuroglancer.CoordinateSpace(
+            names=["z", "y", "x"], units="m", scales=[2e-6, 1.8e-6, 1.8e-6]
+        )
+
+        with tempfile.TemporaryDirectory() as path:
+            generate_precomputed_cells(cells, path, res)
+
+            with open(os.path.join(path, "info")) as info_file:
+                info = json.load(info_file)
+
+            with open(os.path.join(path, "spatial0", "0_0_0"), "rb") as f:
+                data = f.read()
+
+        self.assertEqual(info["lower_bound"], [30.0, 5.0, 10.0])
+        self.assertEqual(info["upper_bound"], [40.0, 21.0, 12.0])
+        self.assertEqual(info["spatial"][0]["limit"], 3)
+
+        self.assertEqual(struct.unpack("<Q", data[:8])[0], 3)
+        np.testing.assert_array_equal(
+            np.frombuffer(data[8:44], dtype="<f4").reshape(-1, 3),
+            [[30, 20, 10], [31, 21, 11], [40, 5, 12]],
+        )
+        np.testing.assert_array_equal(
+            np.frombuffer(data[44:], dtype="<u8"), [0, 1, 2]
+        )
+
+    def test_generate_precomputed_cells_from_array(self):
+        """
+        Test that an array of cells is written like the cell dicts
+        """
+        cells = [
+            {"x": 10, "y": 20, "z": 30},
+            {"x": 11, "y": 21, "z": 31},
+        ]
+        res = neuroglancer.CoordinateSpace(
+            names=["z", "y", "x"], units="m", scales=[2e-6, 1.8e-6, 1.8e-6]
+        )
+
+        outputs = []
+        with tempfile.TemporaryDirectory() as path:
+            for cells_input in [
+                cells,
+                np.array([[10, 20, 30], [11, 21, 31]], dtype=np.int32),
+            ]:
+                generate_precomputed_cells(cells_input, path, res)
+
+                with open(os.path.join(path, "spatial0", "0_0_0"), "rb") as f:
+                    outputs.append(f.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_generate_precomputed_cells_in_chunks(self):
+        """
+        Test that writing the cells in chunks does not change the files
+        """
+        cells = [{"x": x, "y": 2 * x, "z": 100 - x} for x in range(5)]
+        res = neuroglancer.CoordinateSpace(
+            names=["z", "y", "x"], units="m", scales=[2e-6, 1.8e-6, 1.8e-6]
+        )
+
+        outputs = []
+        with tempfile.TemporaryDirectory() as path:
+            for chunk_size in [len(cells), 2]:
+                with mock.patch(
+                    "ng_link.ng_layer._CELLS_CHUNK_SIZE", chunk_size
+                ):
+                    generate_precomputed_cells(cells, path, res)
+
+                with open(os.path.join(path, "info")) as info_file:
+                    info = info_file.read()
+
+                with open(os.path.join(path, "spatial0", "0_0_0"), "rb") as f:
+                    outputs.append((info, f.read()))
+
+        self.assertEqual(outputs[0], outputs[1])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,12 +1,365 @@
-"""Tests ng layer class methods."""
+"""Tests ng state class methods."""
 
+import json
+import os
+import tempfile
 import unittest
+from unittest import mock
+
+import fsspec
+import numpy as np
+
+from ng_link.ng_state import (
+    NgState,
+    get_points_from_xml,
+    get_points_from_xml_array,
+)
+
+XML_CELLS = """<?xml version="1.0" encoding="UTF-8"?>
+<CellCounter_Marker_File>
+  <Marker_Data>
+    <Marker_Type>
+      <Type>1</Type>
+      <Marker>
+        <MarkerX>10</MarkerX>
+        <MarkerY>20</MarkerY>
+        <MarkerZ>30</MarkerZ>
+      </Marker>
+      <Marker>
+        <MarkerX>11</MarkerX>
+        <MarkerY>21</MarkerY>
+        <MarkerZ>31</MarkerZ>
+      </Marker>
+    </Marker_Type>
+  </Marker_Data>
+</CellCounter_Marker_File>
+"""
 
 
 class NgStateTest(unittest.TestCase):
     """Tests ng state class methods."""
 
-    pass
+    def setUp(self):
+        """
+        Sets a basic input configuration for the tests
+        """
+        self.input_config = {
+            "dimensions": {
+                "z": {"voxel_size": 2.0, "unit": "microns"},
+                "y": {"voxel_size": 1.8, "unit": "microns"},
+                "x": {"voxel_size": 1.8, "unit": "microns"},
+                "t": {"voxel_size": 0.001, "unit": "seconds"},
+            },
+            "layers": [
+                {
+                    "source": "image_path.zarr",
+                    "type": "image",
+                    "channel": 0,
+                }
+            ],
+        }
+
+    def test_dimensions_conversion(self):
+        """
+        Test that the dimensions are converted to neuroglancer units
+        """
+        ng_state = NgState(
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+        dimensions = ng_state.dimensions
+
+        self.assertEqual(list(dimensions.keys()), ["z", "y", "x", "t"])
+        self.assertAlmostEqual(dimensions["z"][0] * 1e6, 2.0)
+        self.assertAlmostEqual(dimensions["x"][0] * 1e6, 1.8)
+        self.assertEqual(dimensions["x"][1], "m")
+        self.assertAlmostEqual(dimensions["t"][0], 0.001)
+        self.assertEqual(dimensions["t"][1], "s")
+
+    def test_dimensions_uncommon_unit(self):
+        """
+        Test that units outside the scale tables are converted with pint
+        """
+        self.input_config["dimensions"]["z"] = {
+            "voxel_size": 2.0,
+            "unit": "angstrom",
+        }
+
+        ng_state = NgState(
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+        self.assertAlmostEqual(ng_state.dimensions["z"][0] * 1e10, 2.0)
+        self.assertEqual(ng_state.dimensions["z"][1], "m")
+
+    def test_state_display_options(self):
+        """
+        Test that the display options of the input config are kept
+        in the state
+        """
+        self.input_config["showAxisLines"] = False
+
+        ng_state = NgState(
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+        state = ng_state.state
+
+        self.assertFalse(ng_state.show_axis_lines)
+        self.assertFalse(state["showAxisLines"])
+        self.assertTrue(state["showScaleBar"])
+        self.assertEqual(state["dimensions"], ng_state.dimensions)
+        self.assertEqual(len(state["layers"]), 1)
+        self.assertEqual(
+            state["ng_link"],
+            "https://neuroglancer-demo.appspot.com/"
+            "#!s3://silly/bucket/dataset/process_output.json",
+        )
+
+    def test_state_cache(self):
+        """
+        Test that the state is cached until an attribute is set
+        """
+        ng_state = NgState(
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+        state = ng_state.state
+        self.assertIs(ng_state.state, state)
+
+        ng_state.show_scale_bar = False
+        self.assertIsNot(ng_state.state, state)
+        self.assertFalse(ng_state.state["showScaleBar"])
+
+    def test_save_state_as_json(self):
+        """
+        Test that the saved json contains the state
+        """
+        with tempfile.TemporaryDirectory() as output_dir:
+            ng_state = NgState(
+                input_config=self.input_config,
+                mount_service="s3",
+                bucket_path="silly/bucket",
+                output_dir=output_dir,
+            )
+            ng_state.save_state_as_json()
+
+            with open(
+                os.path.join(output_dir, "process_output.json")
+            ) as json_file:
+                saved_state = json.load(json_file)
+
+        self.assertEqual(saved_state, json.loads(json.dumps(ng_state.state)))
+
+    def test_save_state_as_json_streaming(self):
+        """
+        Test that the streamed json matches the saved json
+        """
+        with tempfile.TemporaryDirectory() as output_dir:
+            ng_state = NgState(
+                input_config=self.input_config,
+                mount_service="s3",
+                bucket_path="silly/bucket",
+                output_dir=output_dir,
+            )
+            ng_state.save_state_as_json_streaming()
+
+            with open(
+                os.path.join(output_dir, "process_output.json")
+            ) as json_file:
+                saved_state = json.load(json_file)
+
+        self.assertEqual(saved_state, json.loads(json.dumps(ng_state.state)))
+
+    def test_save_state_to_s3(self):
+        """
+        Test that the state is uploaded where the link points to
+        """
+        s3_client = mock.Mock()
+        ng_state = NgState(
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+        ng_state.save_state_to_s3(s3_client=s3_client)
+
+        args, _ = s3_client.upload_fileobj.call_args
+        self.assertEqual(
+            args[1:], ("silly", "bucket/dataset/process_output.json")
+        )
+        self.assertEqual(
+            json.loads(args[0].read()), json.loads(json.dumps(ng_state.state))
+        )
+        self.assertTrue(ng_state.get_url_link().endswith("/".join(args[1:])))
+
+    def test_layers_with_workers(self):
+        """
+        Test that the layers created in worker processes
+        match the ones created in the current process
+        """
+        self.input_config["layers"].append(
+            {"source": "other_image.zarr", "type": "image", "channel": 1}
+        )
+
+        ng_states = [
+            NgState(
+                input_config=self.input_config,
+                mount_service="s3",
+                bucket_path="silly/bucket",
+                output_dir="/tmp/dataset",
+                n_workers=n_workers,
+            )
+            for n_workers in [1, 2]
+        ]
+
+        self.assertEqual(len(ng_states[0].layers), 2)
+        self.assertEqual(ng_states[0].layers, ng_states[1].layers)
+
+    def test_precomputed_annotations_from_array(self):
+        """
+        Test that a precomputed annotation layer writes the
+        cells of an array without converting them to dicts
+        """
+        with tempfile.TemporaryDirectory() as output_dir:
+            cells_path = os.path.join(output_dir, "cells")
+            self.input_config["layers"] = [
+                {
+                    "type": "annotation",
+                    "source": f"precomputed://{cells_path}",
+                    "name": "cell_points",
+                    "annotations": np.array(
+                        [[10, 20, 30], [11, 21, 31]], dtype=np.int32
+                    ),
+                }
+            ]
+
+            NgState(
+                input_config=self.input_config,
+                mount_service="s3",
+                bucket_path="silly/bucket",
+                output_dir=output_dir,
+            )
+
+            with open(os.path.join(cells_path, "info")) as info_file:
+                info = json.load(info_file)
+
+        self.assertEqual(info["lower_bound"], [30.0, 20.0, 10.0])
+        self.assertEqual(info["upper_bound"], [31.0, 21.0, 11.0])
+        self.assertEqual(info["spatial"][0]["limit"], 2)
+
+    def test_unknown_layer_type(self):
+        """
+        Test that NgState fails with a layer type that
+        has not been implemented
+        """
+        self.input_config["layers"].append({"type": "mesh"})
+
+        self.assertRaisesRegex(
+            NotImplementedError,
+            "Layer type mesh has not been implemented",
+            NgState,
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+    def test_url_link_follows_attributes(self):
+        """
+        Test that the link points to the json after
+        changing the attributes of the state
+        """
+        ng_state = NgState(
+            input_config=self.input_config,
+            mount_service="s3",
+            bucket_path="silly/bucket",
+            output_dir="/tmp/dataset",
+        )
+
+        # Caching the state before changing the attributes
+        ng_state.state
+
+        ng_state.dataset_name = "other"
+        ng_state.json_name = "v2.json"
+
+        self.assertEqual(
+            ng_state.get_url_link(),
+            "https://neuroglancer-demo.appspot.com/"
+            "#!s3://silly/bucket/other/v2.json",
+        )
+        self.assertEqual(ng_state.state["ng_link"], ng_state.get_url_link())
+
+
+class GetPointsFromXmlTest(unittest.TestCase):
+    """Tests the cell points XML parser."""
+
+    def setUp(self):
+        """
+        Writes a cell counter XML file for the tests
+        """
+        xml_file, self.xml_path = tempfile.mkstemp(suffix=".xml")
+
+        with os.fdopen(xml_file, "w") as xml_writer:
+            xml_writer.write(XML_CELLS)
+
+    def tearDown(self):
+        """
+        Removes the cell counter XML file
+        """
+        os.remove(self.xml_path)
+
+    def test_get_points_from_xml(self):
+        """
+        Test that the marker locations are read from the XML
+        """
+        points = get_points_from_xml(self.xml_path)
+
+        self.assertEqual(
+            points,
+            [
+                {"x": 10, "y": 20, "z": 30},
+                {"x": 11, "y": 21, "z": 31},
+            ],
+        )
+
+    def test_get_points_from_xml_array(self):
+        """
+        Test that the marker locations are read into an array
+        """
+        points = get_points_from_xml_array(self.xml_path)
+
+        self.assertEqual(points.dtype, np.int32)
+        np.testing.assert_array_equal(points, [[10, 20, 30], [11, 21, 31]])
+
+    def test_get_points_from_xml_url(self):
+        """
+        Test that the marker locations of an XML url
+        are read through fsspec
+        """
+        xml_url = "memory://cells/cells.xml"
+
+        with fsspec.open(xml_url, "w") as xml_writer:
+            xml_writer.write(XML_CELLS)
+
+        self.addCleanup(fsspec.filesystem("memory").rm, xml_url)
+
+        np.testing.assert_array_equal(
+            get_points_from_xml_array(xml_url), [[10, 20, 30], [11, 21, 31]]
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+"""Tests utility functions."""
+import json
+import math
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from ng_link.utils import utils
+
+
+class SaveDictAsJsonTest(unittest.TestCase):
+    """Tests the json writer."""
+
+    def test_save_dict_as_json_format(self):
+        """
+        Test that the saved json does not depend on the encoder
+        """
+        dictionary = {1: "non str key", "values": [1, 2], "size": 1.8e-6}
+        saved_jsons = []
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            json_path = os.path.join(output_dir, "saved.json")
+
+            for orjson in [utils.orjson, None]:
+                with mock.patch.object(utils, "orjson", orjson):
+                    utils.save_dict_as_json(json_path, dictionary)
+
+                with open(json_path) as json_file:
+                    saved_jsons.append(json_file.read())
+
+        for saved_json in saved_jsons:
+            self.assertEqual(
+                json.loads(saved_json),
+                {"1": "non str key", "values": [1, 2], "size": 1.8e-6},
+            )
+            self.assertTrue(saved_json.startswith('{\n  "1": "non str key"'))
+
+
+class EncodeJsonTest(unittest.TestCase):
+    """Tests the compact json encoder."""
+
+    def test_encode_json_paths(self):
+        """
+        Test that paths are encoded as strings with both encoders
+        """
+        for orjson in [utils.orjson, None]:
+            with mock.patch.object(utils, "orjson", orjson):
+                self.assertEqual(
+                    json.loads(utils.encode_json({"path": Path("a/b")})),
+                    {"path": "a/b"},
+                )
+
+    def test_encode_json_numpy(self):
+        """
+        Test that numpy values are encoded as numbers or
+        fail, instead of being written as strings
+        """
+        array = np.array([[1, 2], [3, 4]], dtype=np.int32)
+
+        if utils.orjson is not None:
+            self.assertEqual(utils.encode_json(array), b"[[1,2],[3,4]]")
+            self.assertRaises(TypeError, utils.encode_json, array[:, ::-1])
+            self.assertRaises(TypeError, utils.encode_json, np.float16(1.5))
+
+        with mock.patch.object(utils, "orjson", None):
+            self.assertRaises(TypeError, utils.encode_json, array)
+            self.assertRaises(TypeError, utils.encode_json, np.float32(1.5))
+
+
+class ReadJsonAsDictTest(unittest.TestCase):
+    """Tests the json reader."""
+
+    def test_read_json_as_dict_nan(self):
+        """
+        Test that the NaN values written by the
+        json module are read with both decoders
+        """
+        with tempfile.TemporaryDirectory() as output_dir:
+            json_path = os.path.join(output_dir, "saved.json")
+
+            with open(json_path, "w") as json_file:
+                json.dump({"value": float("nan")}, json_file)
+
+            for orjson in [utils.orjson, None]:
+                with mock.patch.object(utils, "orjson", orjson):
+                    dictionary = utils.read_json_as_dict(json_path)
+
+                self.assertTrue(math.isnan(dictionary["value"]))
+
+    def test_read_json_as_dict_missing(self):
+        """
+        Test that a missing json is read as None
+        """
+        self.assertIsNone(utils.read_json_as_dict("/missing/file.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()